@@ -0,0 +1,36 @@
+import io
+from typing import TextIO
+
+import pandas as pd
+
+
+class CsvTail:
+    """
+    Read rows that are appended to a CSV file while it is still being written.
+    """
+
+    def __init__(self, file: TextIO):
+        self._file = file
+        self._header = None
+        self._partial_line = ""
+
+    def read(self) -> pd.DataFrame or None:
+        """
+        Read all complete rows that have been appended since the last call.
+
+        A trailing line without a line break is kept back until the rest of it has been written.
+
+        :return: DataFrame with the new rows, which is empty if there are none,
+                 or None if not even the header has been written yet.
+        """
+        lines = (self._partial_line + self._file.read()).split("\n")
+        self._partial_line = lines.pop()
+        lines = [line for line in lines if line.strip() != ""]
+
+        if self._header is None:
+            if len(lines) == 0:
+                return None
+            self._header = lines.pop(0)
+
+        return pd.read_csv(io.StringIO("\n".join([self._header, *lines])), parse_dates=[0],
+                           infer_datetime_format=True)
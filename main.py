@@ -1,5 +1,7 @@
 import argparse
 import sys
+import time
+from pathlib import Path
 
 import pandas as pd
 
@@ -7,12 +9,18 @@ import renderer
 from coverage_providers import CoverageProvider
 from coverage_providers.telekom import CoverageProviderTelekom
 from coverage_providers.vodafone import CoverageProviderVodafone
+from csv_tail import CsvTail
 from network_type import NetworkType
+from signal_statistics import SignalStatistics, load_sessions, save_sessions
 
 
 def main():
     args = init_argparse().parse_args()
 
+    if args.watch:
+        watch(args)
+        return
+
     location_data, signal_data, display_info_data = None, None, None
 
     if args.signal_strengths is not None:
@@ -27,6 +35,16 @@ def main():
         display_info_data = pd.read_csv(args.display_info, parse_dates=[0], infer_datetime_format=True)
         display_info_data = display_info_data.dropna(subset=["latitude", "longitude"])
 
+    statistics = None
+    if signal_data is not None:
+        statistics = SignalStatistics()
+        statistics.update(signal_data)
+        if args.statistics is not None:
+            sessions = load_sessions(args.statistics)
+            sessions[args.id] = statistics
+            save_sessions(args.statistics, sessions)
+            statistics = SignalStatistics.merged(list(sessions.values()))
+
     renderer.render(
         measurement_id=args.id,
         network_type=NetworkType[args.type.upper()] if args.type is not None else None,
@@ -37,15 +55,72 @@ def main():
         display_info_data=display_info_data,
         coverage_provider=get_coverage_provider(args.operator),
         aspect_ratio=args.aspect_ratio,
-        file_type=args.file_type,
+        file_types=args.file_type,
         title=args.title,
         vmin=args.vmin,
         vmax=args.vmax,
         plot_rsrq=args.rsrq,
         show_title=not args.hide_title,
+        rasterized_layers=get_rasterized_layers(args.rasterize),
+        statistics=statistics,
+        color_percentiles=tuple(args.color_percentiles),
     )
 
 
+def watch(args: argparse.Namespace):
+    """
+    Render the measurements and keep re-rendering them as the input files grow, until interrupted.
+    """
+    sessions = load_sessions(args.statistics) if args.statistics is not None else {}
+    sessions.pop(args.id, None)
+
+    live_renderer = renderer.LiveRenderer(
+        measurement_id=args.id,
+        network_type=NetworkType[args.type.upper()] if args.type is not None else None,
+        padding_degrees=args.padding_degrees,
+        dpi=args.dpi,
+        coverage_provider=get_coverage_provider(args.operator),
+        aspect_ratio=args.aspect_ratio,
+        file_types=args.file_type,
+        title=args.title,
+        vmin=args.vmin,
+        vmax=args.vmax,
+        plot_rsrq=args.rsrq,
+        show_title=not args.hide_title,
+        rasterized_layers=get_rasterized_layers(args.rasterize),
+        reference_statistics=SignalStatistics.merged(list(sessions.values())),
+        color_percentiles=tuple(args.color_percentiles),
+    )
+
+    location_tail = CsvTail(args.location_updates) if args.location_updates is not None else None
+    signal_tail = CsvTail(args.signal_strengths) if args.signal_strengths is not None else None
+    display_info_tail = CsvTail(args.display_info) if args.display_info is not None else None
+
+    try:
+        while True:
+            changed = live_renderer.append(
+                location_data=read_tail(location_tail),
+                signal_data=read_tail(signal_tail),
+                display_info_data=read_tail(display_info_tail),
+            )
+            if changed:
+                live_renderer.save()
+                if args.statistics is not None:
+                    save_sessions(args.statistics, {**sessions, args.id: live_renderer.statistics})
+            time.sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def read_tail(tail: CsvTail or None) -> pd.DataFrame or None:
+    if tail is None:
+        return None
+    df = tail.read()
+    if df is None:
+        return None
+    return df.dropna(subset=["latitude", "longitude"])
+
+
 def init_argparse() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         usage="%(prog)s [OPTIONS]",
@@ -131,7 +206,16 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument(
         "--file-type",
         type=str,
-        default="pdf",
+        nargs="+",
+        default=["pdf"],
+    )
+
+    parser.add_argument(
+        "--rasterize",
+        type=str,
+        nargs="*",
+        choices=renderer.RASTER_LAYERS,
+        default=None,
     )
 
     parser.add_argument(
@@ -146,15 +230,49 @@ def init_argparse() -> argparse.ArgumentParser:
         default=None,
     )
 
+    parser.add_argument(
+        "--color-percentiles",
+        type=float,
+        nargs=2,
+        default=[0, 100],
+    )
+
+    parser.add_argument(
+        "--statistics",
+        type=Path,
+        default=None,
+    )
+
     parser.add_argument(
         "--rsrq",
         action='store_true',
         default=False,
     )
 
+    parser.add_argument(
+        "--watch",
+        action='store_true',
+        default=False,
+    )
+
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=60.0,
+    )
+
     return parser
 
 
+def get_rasterized_layers(rasterize: list[str] or None) -> list[str]:
+    if rasterize is None:
+        return []
+    # "--rasterize" without any layer names rasterizes all data layers.
+    if len(rasterize) == 0:
+        return list(renderer.RASTER_LAYERS)
+    return rasterize
+
+
 def get_coverage_provider(operator: str) -> CoverageProvider or None:
     if operator == "Telekom":
         return CoverageProviderTelekom()
@@ -8,15 +8,27 @@ import numpy as np
 import tilemapbase
 from PIL import Image, ImageEnhance, ImageChops
 from matplotlib.axes import Subplot
+from matplotlib.collections import PathCollection
 from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.transforms import Bbox
 from tilemapbase import Extent
 
 from coverage_providers import CoverageProvider
 from network_type import NetworkType
+from signal_statistics import SignalStatistics
 
 tilemapbase.start_logging()
 tilemapbase.init(create=True)
 
+# Heights in pixels that operator coverage images are requested at. Rounding the
+# plot area up to one of these keeps the number of distinct cached images small,
+# so that renders at similar resolutions can share them.
+OPERATOR_MAP_HEIGHTS = (250, 500, 1000, 2000, 4000)
+
+# Data layers that can be embedded as a single image at output DPI instead of vector objects.
+RASTER_LAYERS = ("locations", "signal", "display-info")
+
 
 def render(measurement_id: str,
            network_type: NetworkType or None,
@@ -27,19 +39,183 @@ def render(measurement_id: str,
            display_info_data: pd.DataFrame or None,
            coverage_provider: CoverageProvider or None,
            aspect_ratio: float,
-           file_type: str,
+           file_types: list[str],
            title: str or None,
            vmin: int or None,
            vmax: int or None,
            plot_rsrq: bool,
-           show_title: bool = True):
-    if location_data is not None:
-        bounding_box_data = location_data
-    elif signal_data is not None:
-        bounding_box_data = signal_data
-    elif display_info_data is not None:
-        bounding_box_data = display_info_data
-    else:
+           show_title: bool = True,
+           rasterized_layers: list[str] = (),
+           statistics: SignalStatistics or None = None,
+           color_percentiles: tuple[float, float] = (0, 100)):
+    _draw(network_type=network_type, padding_degrees=padding_degrees, dpi=dpi, location_data=location_data,
+          signal_data=signal_data, display_info_data=display_info_data, coverage_provider=coverage_provider,
+          aspect_ratio=aspect_ratio, title=title, vmin=vmin, vmax=vmax, plot_rsrq=plot_rsrq,
+          show_title=show_title, rasterized_layers=rasterized_layers, statistics=statistics,
+          color_percentiles=color_percentiles)
+    _save(measurement_id=measurement_id, coverage_provider=coverage_provider, network_type=network_type, dpi=dpi,
+          file_types=file_types, plot_rsrq=plot_rsrq, display_info_data=display_info_data)
+
+
+class LiveRenderer:
+    """
+    Render a map for measurements that are still being recorded.
+
+    Newly appended measurements are projected and added to the already drawn artists. The map is only drawn from
+    scratch if new locations fall outside the current bounding box, or if the new data cannot be added to the
+    existing artists.
+
+    Statistics of the appended signal strength measurements are kept in `statistics`. Together with the
+    reference statistics of other sessions, they determine the colour scale without rescanning the data.
+    """
+
+    def __init__(self,
+                 measurement_id: str,
+                 network_type: NetworkType or None,
+                 padding_degrees: float,
+                 dpi: int,
+                 coverage_provider: CoverageProvider or None,
+                 aspect_ratio: float,
+                 file_types: list[str],
+                 title: str or None,
+                 vmin: int or None,
+                 vmax: int or None,
+                 plot_rsrq: bool,
+                 show_title: bool = True,
+                 rasterized_layers: list[str] = (),
+                 reference_statistics: SignalStatistics or None = None,
+                 color_percentiles: tuple[float, float] = (0, 100)):
+        self._measurement_id = measurement_id
+        self._network_type = network_type
+        self._padding_degrees = padding_degrees
+        self._dpi = dpi
+        self._coverage_provider = coverage_provider
+        self._aspect_ratio = aspect_ratio
+        self._file_types = file_types
+        self._title = title
+        self._vmin = vmin
+        self._vmax = vmax
+        self._plot_rsrq = plot_rsrq
+        self._show_title = show_title
+        self._rasterized_layers = rasterized_layers
+        self._reference_statistics = reference_statistics
+        self._color_percentiles = color_percentiles
+        self.statistics = SignalStatistics()
+
+        self._location_data = None
+        self._signal_data = None
+        self._display_info_data = None
+        self._plot = None
+
+    def append(self, location_data: pd.DataFrame or None = None, signal_data: pd.DataFrame or None = None,
+               display_info_data: pd.DataFrame or None = None) -> bool:
+        """
+        Add newly recorded measurements to the map.
+
+        :param location_data: New location updates, if any.
+        :param signal_data: New signal strength measurements, if any.
+        :param display_info_data: New display info updates, if any.
+        :return: Whether the map has changed.
+        """
+        location_data = location_data if location_data is not None and not location_data.empty else None
+        signal_data = signal_data if signal_data is not None and not signal_data.empty else None
+        display_info_data = display_info_data if display_info_data is not None and not display_info_data.empty \
+            else None
+
+        if location_data is None and signal_data is None and display_info_data is None:
+            return False
+
+        self._location_data = _concat(self._location_data, location_data)
+        self._signal_data = _concat(self._signal_data, signal_data)
+        self._display_info_data = _concat(self._display_info_data, display_info_data)
+
+        if signal_data is not None:
+            self.statistics.update(signal_data)
+
+        if self._requires_redraw(location_data, signal_data, display_info_data):
+            self._redraw()
+            return True
+
+        if location_data is not None:
+            _extend_location_updates(self._plot["location_line"], location_data)
+
+        if signal_data is not None:
+            color_limits = _get_color_limits(self._color_statistics(), network_type=self._network_type,
+                                             vmin=self._vmin, vmax=self._vmax, plot_rsrq=self._plot_rsrq,
+                                             percentiles=self._color_percentiles)
+            _extend_signal_strength(self._plot["signal_scatter"], network_type=self._network_type,
+                                    signal_data=signal_data, color_limits=color_limits, plot_rsrq=self._plot_rsrq)
+
+        return True
+
+    def save(self):
+        """
+        Save the map in its current state. Nothing is saved before any measurements have been appended.
+        """
+        if self._plot is None:
+            return
+
+        plt.figure(self._plot["fig"].number)
+        _save(measurement_id=self._measurement_id, coverage_provider=self._coverage_provider,
+              network_type=self._network_type, dpi=self._dpi, file_types=self._file_types,
+              plot_rsrq=self._plot_rsrq, display_info_data=self._display_info_data)
+
+    def _requires_redraw(self, location_data: pd.DataFrame or None, signal_data: pd.DataFrame or None,
+                         display_info_data: pd.DataFrame or None) -> bool:
+        if self._plot is None:
+            return True
+
+        # Display info lines run along all location updates after their timestamp,
+        # so every new row of either data set changes them.
+        if self._display_info_data is not None and (location_data is not None or display_info_data is not None):
+            return True
+
+        if location_data is not None and self._plot["location_line"] is None:
+            return True
+
+        if signal_data is not None and self._plot["signal_scatter"] is None:
+            return True
+
+        bounding_box_data = _get_bounding_box_data(location_data, signal_data, display_info_data)
+        return bounding_box_data is not None \
+            and not _is_within_bounding_box(bounding_box_data, self._plot["bounding_box"])
+
+    def _redraw(self):
+        if self._plot is not None:
+            plt.close(self._plot["fig"])
+
+        self._plot = _draw(network_type=self._network_type, padding_degrees=self._padding_degrees, dpi=self._dpi,
+                           location_data=self._location_data, signal_data=self._signal_data,
+                           display_info_data=self._display_info_data, coverage_provider=self._coverage_provider,
+                           aspect_ratio=self._aspect_ratio, title=self._title, vmin=self._vmin, vmax=self._vmax,
+                           plot_rsrq=self._plot_rsrq, show_title=self._show_title,
+                           rasterized_layers=self._rasterized_layers, statistics=self._color_statistics(),
+                           color_percentiles=self._color_percentiles)
+
+    def _color_statistics(self) -> SignalStatistics:
+        if self._reference_statistics is None:
+            return self.statistics
+        return SignalStatistics.merged([self._reference_statistics, self.statistics])
+
+
+def _draw(network_type: NetworkType or None,
+          padding_degrees: float,
+          dpi: int,
+          location_data: pd.DataFrame or None,
+          signal_data: pd.DataFrame or None,
+          display_info_data: pd.DataFrame or None,
+          coverage_provider: CoverageProvider or None,
+          aspect_ratio: float,
+          title: str or None,
+          vmin: int or None,
+          vmax: int or None,
+          plot_rsrq: bool,
+          show_title: bool,
+          rasterized_layers: list[str],
+          statistics: SignalStatistics or None,
+          color_percentiles: tuple[float, float]) -> dict:
+    bounding_box_data = _get_bounding_box_data(location_data, signal_data, display_info_data)
+    if bounding_box_data is None:
         raise ValueError("At least one location data set is required.")
 
     bounding_box = _get_bounding_box(bounding_box_data[["latitude", "longitude"]], padding_degrees)
@@ -53,15 +229,24 @@ def render(measurement_id: str,
     plotter = tilemapbase.Plotter(extent, tile_provider, width=3 * dpi)
     plotter.plot(ax, tile_provider)
 
+    location_line, signal_scatter = None, None
+
     if location_data is not None:
-        _plot_location_updates(ax, location_data)
+        location_line = _plot_location_updates(ax, location_data, rasterized="locations" in rasterized_layers)
 
     if signal_data is not None:
-        _scatter_signal_strength(network_type=network_type, signal_data=signal_data, fig=fig, ax=ax,
-                                 vmin=vmin, vmax=vmax, plot_rsrq=plot_rsrq)
+        if statistics is None:
+            statistics = SignalStatistics()
+            statistics.update(signal_data)
+        color_limits = _get_color_limits(statistics, network_type=network_type, vmin=vmin, vmax=vmax,
+                                         plot_rsrq=plot_rsrq, percentiles=color_percentiles)
+        signal_scatter = _scatter_signal_strength(network_type=network_type, signal_data=signal_data, fig=fig,
+                                                  ax=ax, color_limits=color_limits, plot_rsrq=plot_rsrq,
+                                                  rasterized="signal" in rasterized_layers)
 
     if display_info_data is not None:
-        _plot_display_info(ax=ax, location_data=location_data, display_info_data=display_info_data)
+        _plot_display_info(ax=ax, location_data=location_data, display_info_data=display_info_data,
+                           rasterized="display-info" in rasterized_layers)
 
     if coverage_provider is not None:
         _render_operator_map(coverage_provider=coverage_provider, network_type=network_type, ax=ax,
@@ -70,18 +255,62 @@ def render(measurement_id: str,
     if show_title:
         plt.title(_get_title(title, network_type, coverage_provider, signal_data, plot_rsrq))
 
-    path = _create_filename(measurement_id=measurement_id, coverage_provider=coverage_provider,
-                            network_type=network_type, dpi=dpi, file_type=file_type, plot_rsrq=plot_rsrq,
-                            name="override" if display_info_data is not None else "coverage")
-    path.parent.mkdir(parents=True, exist_ok=True)
-
-    plt.savefig(
-        path,
-        format=file_type,
-        dpi=dpi,
-        bbox_inches="tight",
-        transparent=True,
-    )
+    return {
+        "fig": fig,
+        "bounding_box": bounding_box,
+        "location_line": location_line,
+        "signal_scatter": signal_scatter,
+    }
+
+
+def _save(measurement_id: str, coverage_provider: CoverageProvider or None, network_type: NetworkType or None,
+          dpi: int, file_types: list[str], plot_rsrq: bool, display_info_data: pd.DataFrame or None):
+    bbox_inches = _get_tight_bbox(plt.gcf())
+
+    for file_type in file_types:
+        path = _create_filename(measurement_id=measurement_id, coverage_provider=coverage_provider,
+                                network_type=network_type, dpi=dpi, file_type=file_type, plot_rsrq=plot_rsrq,
+                                name="override" if display_info_data is not None else "coverage")
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        plt.savefig(
+            path,
+            format=file_type,
+            dpi=dpi,
+            bbox_inches=bbox_inches,
+            transparent=True,
+        )
+
+
+def _get_tight_bbox(fig: Figure, pad_inches: float = 0.1) -> Bbox:
+    """
+    Compute the tight bounding box of the figure once, so it can be reused for every saved file.
+
+    Passing bbox_inches="tight" to savefig renders the whole figure a second time just to measure it.
+    Measuring the layout with the canvas renderer avoids that extra pass.
+
+    :param fig: Figure to be saved.
+    :param pad_inches: Padding around the tight bounding box, same as the default of savefig.
+    :return: Bounding box in inches.
+    """
+    return fig.get_tightbbox(fig.canvas.get_renderer()).padded(pad_inches)
+
+
+def _concat(df: pd.DataFrame or None, new_df: pd.DataFrame or None) -> pd.DataFrame or None:
+    if df is None:
+        return new_df
+    if new_df is None:
+        return df
+    return pd.concat([df, new_df], ignore_index=True)
+
+
+def _get_bounding_box_data(location_data: pd.DataFrame or None, signal_data: pd.DataFrame or None,
+                           display_info_data: pd.DataFrame or None) -> pd.DataFrame or None:
+    if location_data is not None:
+        return location_data
+    if signal_data is not None:
+        return signal_data
+    return display_info_data
 
 
 def _get_title(title: str or None, network_type: NetworkType or None, coverage_provider: CoverageProvider or None,
@@ -107,14 +336,24 @@ def _get_title(title: str or None, network_type: NetworkType or None, coverage_p
     return s.strip()
 
 
-def _plot_location_updates(ax: Subplot, location_data: pd.DataFrame):
+def _plot_location_updates(ax: Subplot, location_data: pd.DataFrame, rasterized: bool = False) -> Line2D:
     projected_loc = _project_coordinates(location_data)
-    ax.plot(
+    [line] = ax.plot(
         projected_loc["longitude"],
         projected_loc["latitude"],
         color="darkgray",
         linewidth=1,
-        zorder=1
+        zorder=1,
+        rasterized=rasterized,
+    )
+    return line
+
+
+def _extend_location_updates(line: Line2D, location_data: pd.DataFrame):
+    projected_loc = _project_coordinates(location_data)
+    line.set_data(
+        np.concatenate([line.get_xdata(), projected_loc["longitude"]]),
+        np.concatenate([line.get_ydata(), projected_loc["latitude"]]),
     )
 
 
@@ -139,51 +378,72 @@ def _project_coordinates(df) -> dict[str, list]:
 
 
 def _scatter_signal_strength(network_type: NetworkType, signal_data: pd.DataFrame, fig: Figure, ax: Subplot,
-                             vmin: int or None, vmax: int or None, plot_rsrq: bool):
+                             color_limits: tuple[float or None, float or None], plot_rsrq: bool,
+                             rasterized: bool = False) -> PathCollection:
     df = signal_data.loc[signal_data["networkType"] == network_type]
     projected = _project_coordinates(df)
-
-    if plot_rsrq and network_type == NetworkType.LTE:
-        c = df["rsrq"]
-    elif plot_rsrq and network_type == NetworkType.NR:
-        c = df["ssRsrq"]
-    else:
-        c = df["dbm"]
+    column = _get_signal_column(network_type, plot_rsrq)
 
     scatter = ax.scatter(
         x=projected["longitude"],
         y=projected["latitude"],
         linewidth=5,
         marker=".",
-        c=c,
+        c=df[column],
         cmap="rainbow_r",
-        vmin=_get_vmin(signal_data, network_type, vmin, plot_rsrq),
-        vmax=_get_vmax(signal_data, network_type, vmax, plot_rsrq),
+        vmin=color_limits[0],
+        vmax=color_limits[1],
         zorder=3,
+        rasterized=rasterized,
     )
 
     color_bar = fig.colorbar(scatter)
     color_bar.ax.set_ylabel(_get_axis_name(network_type, plot_rsrq))
 
+    return scatter
 
-def _get_vmin(signal_data: pd.DataFrame, network_type: NetworkType, vmin: int or None, plot_rsrq: bool):
-    if vmin is not None:
-        return vmin
-    if plot_rsrq and network_type == NetworkType.LTE:
-        return signal_data["rsrq"].min()
-    if plot_rsrq and network_type == NetworkType.NR:
-        return signal_data["ssRsrq"].min()
-    return signal_data["dbm"].min()
 
+def _extend_signal_strength(scatter: PathCollection, network_type: NetworkType, signal_data: pd.DataFrame,
+                            color_limits: tuple[float or None, float or None], plot_rsrq: bool):
+    """
+    Add new signal strength measurements to an existing scatter plot and update its colour scale.
+    """
+    df = signal_data.loc[signal_data["networkType"] == network_type]
+    if df.empty:
+        return
+
+    projected = _project_coordinates(df)
+    c = df[_get_signal_column(network_type, plot_rsrq)].to_numpy()
+
+    scatter.set_offsets(np.concatenate([
+        scatter.get_offsets(),
+        np.column_stack([projected["longitude"], projected["latitude"]]),
+    ]))
+    scatter.set_array(np.ma.concatenate([scatter.get_array(), c]))
+    scatter.set_clim(*color_limits)
 
-def _get_vmax(signal_data: pd.DataFrame, network_type: NetworkType, vmax: int or None, plot_rsrq: bool):
-    if vmax is not None:
-        return vmax
+
+def _get_signal_column(network_type: NetworkType, plot_rsrq: bool) -> str:
     if plot_rsrq and network_type == NetworkType.LTE:
-        return signal_data["rsrq"].max()
+        return "rsrq"
     if plot_rsrq and network_type == NetworkType.NR:
-        return signal_data["ssRsrq"].max()
-    return signal_data["dbm"].max()
+        return "ssRsrq"
+    return "dbm"
+
+
+def _get_color_limits(statistics: SignalStatistics, network_type: NetworkType, vmin: int or None,
+                      vmax: int or None, plot_rsrq: bool, percentiles: tuple[float, float]
+                      ) -> tuple[float or None, float or None]:
+    """
+    Get the limits of the colour scale. Limits that are not given explicitly are taken from the statistics
+    of the rendered network type.
+    """
+    column = _get_signal_column(network_type, plot_rsrq)
+    statistics_vmin, statistics_vmax = statistics.color_limits(network_type, column, percentiles)
+    return (
+        vmin if vmin is not None else statistics_vmin,
+        vmax if vmax is not None else statistics_vmax,
+    )
 
 
 def _get_axis_name(network_type: NetworkType, plot_rsrq: bool):
@@ -196,13 +456,15 @@ def _get_axis_name(network_type: NetworkType, plot_rsrq: bool):
     return "???"
 
 
-def _plot_display_info(ax: Subplot, location_data: pd.DataFrame, display_info_data: pd.DataFrame):
+def _plot_display_info(ax: Subplot, location_data: pd.DataFrame, display_info_data: pd.DataFrame,
+                       rasterized: bool = False):
     projected = _project_coordinates(display_info_data)
     ax.scatter(
         x=projected["longitude"],
         y=projected["latitude"],
         color="gray",
         s=8,
+        rasterized=rasterized,
     )
 
     for i, display_info in display_info_data.iterrows():
@@ -220,6 +482,7 @@ def _plot_display_info(ax: Subplot, location_data: pd.DataFrame, display_info_da
             color=_map_override_network_type(display_info["overrideNetworkType"], display_info["networkType"]),
             zorder=i + 1,
             label=name,
+            rasterized=rasterized,
         )
     _legend_without_duplicate_labels(ax)
 
@@ -251,12 +514,13 @@ def _map_override_network_type(override: str, connected: str) -> str:
 def _render_operator_map(coverage_provider: CoverageProvider, network_type: NetworkType,
                          ax: matplotlib.axes.Subplot, bounding_box: dict[str, dict[str, float]],
                          aspect_ratio: float, extent: Extent):
+    height = _get_operator_map_height(ax, aspect_ratio)
     coverage_img_path = coverage_provider.fetch_img(
         network_type=network_type,
         bounding_box=bounding_box,
         size={
-            "height": 2000,
-            "width": 2000 * aspect_ratio,
+            "height": height,
+            "width": round(height * aspect_ratio),
         },
     )
 
@@ -274,6 +538,25 @@ def _render_operator_map(coverage_provider: CoverageProvider, network_type: Netw
     ax.imshow(img, extent=[extent.xmin, extent.xmax, extent.ymax, extent.ymin], cmap=cm.Greys, alpha=0.6)
 
 
+def _get_operator_map_height(ax: matplotlib.axes.Subplot, aspect_ratio: float) -> int:
+    """
+    Get the height in pixels the operator coverage image should be requested at.
+
+    The map keeps its aspect ratio inside the axes, so the plot area is bounded by either the height or the width
+    of the axes. Its height is rounded up to the next of the OPERATOR_MAP_HEIGHTS.
+
+    :param ax: Axes the coverage image will be drawn on.
+    :param aspect_ratio: Aspect ratio of the map.
+    :return: Height of the coverage image in pixels.
+    """
+    window_extent = ax.get_window_extent()
+    plot_height = min(window_extent.height, window_extent.width / aspect_ratio)
+    for height in OPERATOR_MAP_HEIGHTS:
+        if height >= plot_height:
+            return height
+    return OPERATOR_MAP_HEIGHTS[-1]
+
+
 def _get_bounding_box(lat_long_df: pd.DataFrame, padding_degrees: float) -> dict[str, dict[str, float]]:
     """
     Get the map bounding box by searching for minimum and maximum latitude and longitude
@@ -295,6 +578,13 @@ def _get_bounding_box(lat_long_df: pd.DataFrame, padding_degrees: float) -> dict
     }
 
 
+def _is_within_bounding_box(lat_long_df: pd.DataFrame, bounding_box: dict[str, dict[str, float]]) -> bool:
+    return lat_long_df["latitude"].min() >= bounding_box["min"]["latitude"] \
+        and lat_long_df["longitude"].min() >= bounding_box["min"]["longitude"] \
+        and lat_long_df["latitude"].max() <= bounding_box["max"]["latitude"] \
+        and lat_long_df["longitude"].max() <= bounding_box["max"]["longitude"]
+
+
 def _create_filename(measurement_id: str, name: str, dpi: int, file_type: str, plot_rsrq: bool,
                      coverage_provider: CoverageProvider or None, network_type: NetworkType or None) -> Path:
     s = f"out/graphs/{measurement_id}/{name}-"
@@ -0,0 +1,205 @@
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from network_type import NetworkType
+
+METRICS = ("dbm", "rsrq", "ssRsrq")
+
+
+class MetricSummary:
+    """
+    Streaming summary of a single signal metric: number of values, minimum, maximum and a quantile sketch.
+
+    The sketch counts values in bins of a fixed width. Signal metrics are reported in whole dB, so with the default
+    width of 1 dB the quantiles are exact, and the size of the sketch only depends on the range of the values.
+    Summaries of different chunks or sessions are merged by adding up their bin counts.
+    """
+
+    def __init__(self, bin_width: float = 1.0):
+        self.bin_width = bin_width
+        self.count = 0
+        self.min = math.nan
+        self.max = math.nan
+        self._bins: dict[int, int] = {}
+
+    def update(self, values: np.ndarray):
+        """
+        Add values to the summary. Missing values are ignored.
+
+        :param values: Values of the metric.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+
+        self.count += len(values)
+        self.min = float(np.fmin(self.min, values.min()))
+        self.max = float(np.fmax(self.max, values.max()))
+
+        bins, counts = np.unique(np.floor(values / self.bin_width).astype(int), return_counts=True)
+        for b, count in zip(bins, counts):
+            self._bins[int(b)] = self._bins.get(int(b), 0) + int(count)
+
+    def merge(self, other: "MetricSummary"):
+        """
+        Add all values of another summary to this one.
+
+        :param other: Summary with the same bin width.
+        """
+        if other.bin_width != self.bin_width:
+            raise ValueError("Only summaries with the same bin width can be merged.")
+
+        self.count += other.count
+        self.min = float(np.fmin(self.min, other.min))
+        self.max = float(np.fmax(self.max, other.max))
+        for b, count in other._bins.items():
+            self._bins[b] = self._bins.get(b, 0) + count
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile of the summarized values.
+
+        :param q: Quantile between 0 and 1.
+        :return: Lower edge of the bin containing the quantile, or NaN if the summary is empty.
+        """
+        if self.count == 0:
+            return math.nan
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * self.count
+        cumulative = 0
+        for b in sorted(self._bins):
+            cumulative += self._bins[b]
+            if cumulative >= rank:
+                return min(max(b * self.bin_width, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return dict(
+            bin_width=self.bin_width,
+            count=self.count,
+            min=None if math.isnan(self.min) else self.min,
+            max=None if math.isnan(self.max) else self.max,
+            bins={str(b): count for b, count in self._bins.items()},
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MetricSummary":
+        summary = cls(bin_width=data["bin_width"])
+        summary.count = data["count"]
+        summary.min = math.nan if data["min"] is None else data["min"]
+        summary.max = math.nan if data["max"] is None else data["max"]
+        summary._bins = {int(b): count for b, count in data["bins"].items()}
+        return summary
+
+
+class SignalStatistics:
+    """
+    Summaries of every signal metric, separately for each network type.
+    """
+
+    def __init__(self):
+        self._summaries: dict[str, dict[str, MetricSummary]] = {}
+
+    def update(self, signal_data: pd.DataFrame):
+        """
+        Add signal strength measurements to the statistics in a single pass over the data.
+
+        :param signal_data: Signal strength measurements with a "networkType" column and any of the METRICS.
+        """
+        metrics = [metric for metric in METRICS if metric in signal_data.columns]
+        for network_type, df in signal_data.groupby("networkType"):
+            summaries = self._summaries.setdefault(_key(network_type), {})
+            for metric in metrics:
+                summaries.setdefault(metric, MetricSummary()).update(df[metric].to_numpy())
+
+    def merge(self, other: "SignalStatistics"):
+        """
+        Add all measurements of another set of statistics, e.g. of a different chunk or session, to this one.
+        """
+        for network_type, other_summaries in other._summaries.items():
+            summaries = self._summaries.setdefault(network_type, {})
+            for metric, other_summary in other_summaries.items():
+                summaries.setdefault(metric, MetricSummary(other_summary.bin_width)).merge(other_summary)
+
+    def summary(self, network_type: NetworkType, metric: str) -> MetricSummary or None:
+        return self._summaries.get(_key(network_type), {}).get(metric)
+
+    def color_limits(self, network_type: NetworkType, metric: str,
+                     percentiles: tuple[float, float] = (0, 100)) -> tuple[float or None, float or None]:
+        """
+        Get limits for the colour scale of a metric.
+
+        Percentiles other than 0 and 100 clip the colour scale, so that single outliers don't squash it.
+
+        :param network_type: Type of cellular network that is rendered.
+        :param metric: Name of the metric.
+        :param percentiles: Lower and upper percentile of the measurements that the colour scale should span.
+        :return: Lower and upper limit, or None if there are no measurements.
+        """
+        summary = self.summary(network_type, metric)
+        if summary is None or summary.count == 0:
+            return None, None
+        return summary.quantile(percentiles[0] / 100), summary.quantile(percentiles[1] / 100)
+
+    def to_dict(self) -> dict:
+        return {
+            network_type: {metric: summary.to_dict() for metric, summary in summaries.items()}
+            for network_type, summaries in self._summaries.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SignalStatistics":
+        statistics = cls()
+        statistics._summaries = {
+            network_type: {metric: MetricSummary.from_dict(summary) for metric, summary in summaries.items()}
+            for network_type, summaries in data.items()
+        }
+        return statistics
+
+    @classmethod
+    def merged(cls, statistics: list["SignalStatistics"]) -> "SignalStatistics":
+        result = cls()
+        for s in statistics:
+            result.merge(s)
+        return result
+
+
+def load_sessions(path: Path) -> dict[str, SignalStatistics]:
+    """
+    Load the statistics of previously rendered measurement sessions.
+
+    :param path: JSON file written by save_sessions. It doesn't need to exist yet.
+    :return: Statistics by measurement ID.
+    """
+    if not path.is_file():
+        return {}
+    with open(path) as file:
+        data = json.load(file)
+    return {measurement_id: SignalStatistics.from_dict(s) for measurement_id, s in data.items()}
+
+
+def save_sessions(path: Path, sessions: dict[str, SignalStatistics]):
+    """
+    Save the statistics of measurement sessions, so that later renders can share their colour scale.
+
+    :param path: JSON file to write.
+    :param sessions: Statistics by measurement ID.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump({measurement_id: s.to_dict() for measurement_id, s in sessions.items()}, file, sort_keys=True)
+
+
+def _key(network_type: NetworkType or str) -> str:
+    if isinstance(network_type, NetworkType):
+        return network_type.value
+    return str(network_type)